@@ -2,50 +2,178 @@
 # Arquitetura simplificada para máxima robustez e estabilidade.
 
 import os
+import re
 import json
+import array
+import atexit
 import logging
 import asyncio
 import httpx
-from datetime import datetime, timedelta
-import pytz
+import orjson
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from telegram import Update, Bot
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ParseMode
-from bs4 import BeautifulSoup
+from telegram.error import RetryAfter, TelegramError
+from telegram.helpers import escape_markdown
+from lxml import etree
+from io import BytesIO
 from email.utils import parsedate_to_datetime
 import time
 from urllib.parse import quote
+import xxhash
 
 # --- CONFIGURAÇÕES ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CONFIG_PATH = "faro_fino_config.json"
+HISTORY_PATH = "faro_fino_history.dat"
 MONITORAMENTO_INTERVAL = 300
-TIMEZONE_BR = pytz.timezone('America/Sao_Paulo')
+TIMEZONE_BR = ZoneInfo('America/Sao_Paulo')
 DIAS_FILTRO_NOTICIAS = 3
+FLUSH_INTERVAL = 30
+POLLING_TIMEOUT = 50
+PALAVRAS_POR_BUSCA = 5
+CACHE_BUSCA_SEGUNDOS = 60
+TAMANHO_MAX_MENSAGEM = 3500
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DEFAULT_CONFIG = {"owner_id": None, "keywords": [], "monitoring_on": False, "history": set()}
+# Cliente HTTP único, reaproveitando conexões (HTTP/2 + keep-alive) entre as buscas.
+_HTTP = httpx.AsyncClient(
+    http2=True, timeout=20,
+    limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300),
+    headers={"User-Agent": "faro-fino/1.0"},
+)
+# Validadores HTTP por URL de busca, para requisições condicionais (304 Not Modified).
+_last_etag = {}
+_last_modified = {}
+# Notícias da última resposta 200 de cada URL, devolvidas quando o servidor responde 304.
+_last_items = {}
+# Última busca: (frozenset das palavras-chave, instante monotônico, notícias). Só uma entrada.
+_FETCH_CACHE = None
+# Links da busca anterior (para as mesmas palavras-chave); já foram avaliados e podem ser pulados.
+_LAST_FETCH_KEYWORDS = None
+_LAST_FETCH_LINKS = set()
+
+DEFAULT_CONFIG = {"owner_id": None, "keywords": [], "monitoring_on": False}
+
+# Configuração mantida em memória; o disco só é tocado na carga inicial e no flush.
+_CONFIG_CACHE = None
+_DIRTY = False
+_HISTORY_DIRTY = False
+_CFG_LOCK = asyncio.Lock()
 
 # --- FUNÇÕES DE DADOS ---
-def load_config():
+def link_digest(link: str) -> int:
+    # O histórico guarda só um hash de 8 bytes por link, não a URL inteira.
+    return xxhash.xxh64_intdigest(link)
+
+def load_history(legacy_links):
+    # Pares (hash, timestamp) em ordem de inserção; o set serve só para consulta rápida.
+    order = deque()
+    if os.path.exists(HISTORY_PATH):
+        packed = array.array('Q')
+        with open(HISTORY_PATH, 'rb') as f:
+            packed.frombytes(f.read())
+        order.extend(zip(packed[0::2], packed[1::2]))
+    # Migra o histórico antigo (lista de links no JSON) para hashes.
+    now = int(time.time())
+    order.extend((link_digest(link), now) for link in legacy_links)
+    return order, {digest for digest, _ in order}
+
+def remember_link(config, digest: int):
+    config['history'].add(digest)
+    config['history_order'].append((digest, int(time.time())))
+
+def prune_history(config) -> bool:
+    # Notícias mais antigas que DIAS_FILTRO_NOTICIAS já são descartadas pelo filtro de data,
+    # então seus hashes não precisam mais ficar no histórico.
+    cutoff = time.time() - timedelta(days=DIAS_FILTRO_NOTICIAS).total_seconds()
+    order, history = config['history_order'], config['history']
+    pruned = False
+    while order and order[0][1] < cutoff:
+        history.discard(order.popleft()[0])
+        pruned = True
+    return pruned
+
+def read_config_files():
     if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            config['history'] = set(config.get('history', []))
-            return config
-    return DEFAULT_CONFIG.copy()
+        with open(CONFIG_PATH, 'rb') as f:
+            config = orjson.loads(f.read())
+    else:
+        config = DEFAULT_CONFIG.copy()
+    legacy_links = config.pop('history', [])
+    config['history_order'], config['history'] = load_history(legacy_links)
+    return config, bool(legacy_links)
+
+async def load_config():
+    global _CONFIG_CACHE, _DIRTY, _HISTORY_DIRTY
+    if _CONFIG_CACHE is None:
+        async with _CFG_LOCK:
+            if _CONFIG_CACHE is None:
+                # Leitura de disco fora do event loop, para não travar o polling.
+                config, migrated = await asyncio.to_thread(read_config_files)
+                if migrated:
+                    _DIRTY = _HISTORY_DIRTY = True
+                _CONFIG_CACHE = config
+    return _CONFIG_CACHE
 
 def save_config(config):
-    to_save = config.copy()
-    to_save['history'] = list(to_save.get('history', set()))
-    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        json.dump(to_save, f, indent=4)
-    logger.info("Configuração local salva.")
+    global _DIRTY
+    _DIRTY = True
+
+def save_history(config):
+    global _HISTORY_DIRTY
+    _HISTORY_DIRTY = True
+
+def snapshot_config() -> list:
+    # Serializa no event loop (rápido e sem concorrência com os handlers);
+    # só a escrita em disco vai para outra thread.
+    global _DIRTY, _HISTORY_DIRTY
+    pending = []
+    if _CONFIG_CACHE is None: return pending
+    if _HISTORY_DIRTY:
+        packed = array.array('Q')
+        for digest, ts in _CONFIG_CACHE['history_order']:
+            packed.append(digest)
+            packed.append(ts)
+        pending.append((HISTORY_PATH, packed.tobytes()))
+        _HISTORY_DIRTY = False
+    if _DIRTY:
+        to_save = {k: v for k, v in _CONFIG_CACHE.items() if k not in ('history', 'history_order')}
+        pending.append((CONFIG_PATH, orjson.dumps(to_save, default=list)))
+        _DIRTY = False
+    return pending
+
+def write_files(pending: list):
+    for path, data in pending:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    if pending:
+        logger.info("Configuração local salva.")
+
+def flush_config():
+    write_files(snapshot_config())
+
+async def flusher():
+    global _DIRTY, _HISTORY_DIRTY
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        async with _CFG_LOCK:
+            try:
+                pending = snapshot_config()
+                await asyncio.to_thread(write_files, pending)
+            except Exception as e:
+                _DIRTY = _HISTORY_DIRTY = True
+                logger.error(f"Falha ao salvar configuração: {e}")
 
 async def do_backup(context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     owner_id = config.get("owner_id")
     if not owner_id: return
     
@@ -67,30 +195,91 @@ async def do_backup(context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Falha ao enviar backup: {e}")
 
 # --- LÓGICA DE BUSCA ---
-async def fetch_news(keywords: list) -> list:
-    news_items = []
-    if not keywords: return news_items
-    
+def build_search_url(keywords: list) -> str:
     # --- CORREÇÃO DEFINITIVA DO SYNTAXERROR ---
     query_parts = [f'"{k}"' for k in keywords]
     query = " OR ".join(query_parts)
     encoded_query = quote(query)
     url = f"https://news.google.com/rss/search?q={encoded_query}&hl=pt-BR&gl=BR&ceid=BR:pt-419&tbs=qdr:h"
     # --- FIM DA CORREÇÃO ---
+    return url
+
+async def fetch_one(keywords: list) -> list | None:
+    news_items = []
+    url = build_search_url(keywords)
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=20)
-        soup = BeautifulSoup(response.content, 'lxml-xml')
-        for item in soup.find_all('item'):
-            pub_date = parsedate_to_datetime(item.find('pubDate').text).astimezone(TIMEZONE_BR)
-            news_items.append({'title': item.find('title').text, 'link': item.find('link').text, 'source': item.find('source').text, 'date': pub_date})
+        headers = {}
+        if url in _last_etag: headers["If-None-Match"] = _last_etag[url]
+        if url in _last_modified: headers["If-Modified-Since"] = _last_modified[url]
+        response = await _HTTP.get(url, headers=headers)
+        # Feed inalterado: reaproveita as notícias já lidas. O /status e o monitoramento
+        # compartilham os validadores, e o histórico já impede reenvios.
+        if response.status_code == 304: return list(_last_items.get(url, []))
+        response.raise_for_status()
+        # Parse em streaming: cada <item> é lido e descartado em seguida.
+        for _, elem in etree.iterparse(BytesIO(response.content), tag='item'):
+            title, link, source, pub_text = (elem.findtext(tag) for tag in ('title', 'link', 'source', 'pubDate'))
+            elem.clear()
+            # Itens incompletos são ignorados aqui, em vez de quebrar o process_news depois.
+            if None in (title, link, source, pub_text): continue
+            # O pubDate já traz o fuso; a conversão para o horário de Brasília fica para o envio.
+            pub_date = parsedate_to_datetime(pub_text)
+            # Datas com fuso "-0000" vêm sem tzinfo; pela RFC 2822 elas estão em UTC.
+            if pub_date.tzinfo is None: pub_date = pub_date.replace(tzinfo=timezone.utc)
+            news_items.append({'title': title, 'link': link, 'source': source, 'date': pub_date})
+        if "ETag" in response.headers: _last_etag[url] = response.headers["ETag"]
+        if "Last-Modified" in response.headers: _last_modified[url] = response.headers["Last-Modified"]
+        _last_items[url] = news_items
     except Exception as e:
-        logger.error(f"Erro na busca: {e}")
+        logger.error(f"Erro na busca ({', '.join(keywords)}): {e}")
+        return None
+    return news_items
+
+async def fetch_news(keywords: list) -> list:
+    global _FETCH_CACHE
+    if not keywords: return []
+
+    cache_key = frozenset(keywords)
+    if _FETCH_CACHE:
+        cached_key, cached_at, cached_items = _FETCH_CACHE
+        if cached_key == cache_key and time.monotonic() - cached_at < CACHE_BUSCA_SEGUNDOS:
+            return cached_items
+
+    # Consultas menores em paralelo: o Google News ignora buscas longas demais,
+    # e uma falha afeta só o seu grupo de palavras.
+    chunks = [keywords[i:i + PALAVRAS_POR_BUSCA] for i in range(0, len(keywords), PALAVRAS_POR_BUSCA)]
+    results = await asyncio.gather(*(fetch_one(c) for c in chunks), return_exceptions=True)
+
+    # Descarta validadores de buscas que não existem mais (palavras-chave alteradas).
+    current_urls = {build_search_url(c) for c in chunks}
+    for cache in (_last_etag, _last_modified, _last_items):
+        for url in [u for u in cache if u not in current_urls]:
+            del cache[url]
+
+    news_items, seen_links, failed = [], set(), False
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Erro na busca: {result}")
+        if result is None or isinstance(result, Exception):
+            failed = True
+            continue
+        for item in result:
+            if item['link'] in seen_links: continue
+            seen_links.add(item['link'])
+            news_items.append(item)
+    # Só buscas completas entram no cache; com falha, a próxima chamada tenta de novo.
+    if not failed:
+        _FETCH_CACHE = (cache_key, time.monotonic(), news_items)
     return news_items
 
+def build_keyword_pattern(keywords: list):
+    # Alternação única: cada texto é varrido uma vez, em vez de uma vez por palavra-chave.
+    return re.compile("|".join(re.escape(k.lower()) for k in keywords))
+
 async def process_news(context: ContextTypes.DEFAULT_TYPE, is_manual: bool = False):
-    config = load_config()
+    global _LAST_FETCH_KEYWORDS, _LAST_FETCH_LINKS
+    config = await load_config()
     owner_id, keywords = config.get("owner_id"), config.get("keywords")
     if not owner_id or not keywords:
         if is_manual:
@@ -104,34 +293,78 @@ async def process_news(context: ContextTypes.DEFAULT_TYPE, is_manual: bool = Fal
     found_news = await fetch_news(keywords)
     new_articles = []
     date_limit = datetime.now(TIMEZONE_BR) - timedelta(days=DIAS_FILTRO_NOTICIAS)
+    history = config['history']
+    history_changed = prune_history(config)
+    lowered = [(k, k.lower()) for k in keywords]
+    pattern = build_keyword_pattern(keywords)
+    last_links = _LAST_FETCH_LINKS if _LAST_FETCH_KEYWORDS == keywords else set()
 
     for article in found_news:
-        if article['link'] in config['history'] or (article['date'] and article['date'] < date_limit): continue
+        if article['link'] in last_links: continue
+        digest = link_digest(article['link'])
+        if digest in history or (article['date'] and article['date'] < date_limit): continue
         text_to_check = f"{article['title']} {article['source']}".lower()
-        if any(k.lower() in text_to_check for k in keywords):
-            article['found_keywords'] = [k for k in keywords if k.lower() in text_to_check]
+        if not pattern.search(text_to_check): continue
+        # A alternação não reporta palavras sobrepostas; a lista exata sai só dos artigos aprovados.
+        matched = [k for k, kl in lowered if kl in text_to_check]
+        if matched:
+            article['found_keywords'] = matched
             new_articles.append(article)
-            config['history'].add(article['link'])
+            remember_link(config, digest)
+            history_changed = True
+
+    if found_news:
+        _LAST_FETCH_KEYWORDS = list(keywords)
+        _LAST_FETCH_LINKS = {article['link'] for article in found_news}
             
+    if history_changed:
+        save_history(config)
     if new_articles:
         await send_notifications(owner_id, new_articles, context)
-
-    save_config(config)
     
     if not is_manual:
         ping_msg = f"_[Auto] Verificação concluída. {len(new_articles)} novas notícias._"
         await context.bot.send_message(chat_id=owner_id, text=ping_msg, parse_mode=ParseMode.MARKDOWN)
 
 async def send_notifications(chat_id, articles, context: ContextTypes.DEFAULT_TYPE):
+    async def send_one(message):
+        while True:
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True)
+                return
+            except RetryAfter as e:
+                logger.warning(f"Limite do Telegram atingido, aguardando {e.retry_after}s.")
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.error(f"Falha ao enviar notificação: {e}")
+                return
+
+    # Agrupa as notícias em resumos de até TAMANHO_MAX_MENSAGEM caracteres
+    # (o limite do Telegram é 4096), em vez de uma mensagem por notícia.
+    chunks, current = [], ""
     for article in articles:
-        date_str = article['date'].strftime('%d/%m/%Y %H:%M')
-        message = (f"📰 *{article['title']}*\n\n"
-                   f"🚨 *Encontrado:* {', '.join(article['found_keywords'])}\n"
-                   f"📅 *Publicado em:* {date_str}\n"
-                   f"🌐 *Fonte:* {article['source']}\n"
-                   f"🔗 [Clique para ler]({article['link']})")
-        await context.bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-        await asyncio.sleep(1)
+        date_str = article['date'].astimezone(TIMEZONE_BR).strftime('%d/%m/%Y %H:%M')
+        # MarkdownV2: todo texto vindo do feed precisa ser escapado, senão o Telegram
+        # rejeita o resumo inteiro por causa de um único "_" ou "[" num título.
+        title = escape_markdown(article['title'] or "", version=2)
+        found = escape_markdown(', '.join(article['found_keywords']), version=2)
+        source = escape_markdown(article['source'] or "", version=2)
+        link = escape_markdown(article['link'], version=2, entity_type='text_link')
+        block = (f"📰 *{title}*\n\n"
+                 f"🚨 *Encontrado:* {found}\n"
+                 f"📅 *Publicado em:* {escape_markdown(date_str, version=2)}\n"
+                 f"🌐 *Fonte:* {source}\n"
+                 f"🔗 [Clique para ler]({link})")
+        if current and len(current) + len(block) + 2 > TAMANHO_MAX_MENSAGEM:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{block}" if current else block
+    if current:
+        chunks.append(current)
+
+    # Partes de um mesmo resumo vão em sequência, para chegarem em ordem.
+    for chunk in chunks:
+        await send_one(chunk)
 
 # --- LOOP DE MONITORAMENTO ---
 async def monitor_loop(app: Application):
@@ -145,7 +378,7 @@ def is_owner(update: Update, config: dict) -> bool:
     return update.effective_user.id == config.get("owner_id")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not config.get('owner_id'):
         config['owner_id'] = update.effective_user.id
         save_config(config)
@@ -154,7 +387,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Bem-vindo de volta!")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not is_owner(update, config): return
     await update.message.reply_text(
         "🤖 *Comandos:*\n\n"
@@ -168,7 +401,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not is_owner(update, config): return
     
     text = update.message.text.strip()
@@ -201,7 +434,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await do_backup(context)
 
 async def restore_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not is_owner(update, config) or not update.message.document: return
     
     document = update.message.document
@@ -221,7 +454,7 @@ async def restore_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"🚨 Erro ao restaurar: {e}")
 
 async def toggle_monitoring(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not is_owner(update, config): return
     config['monitoring_on'] = not config.get('monitoring_on', False)
     save_config(config)
@@ -233,7 +466,7 @@ async def check_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Verificação manual concluída.")
     
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not is_owner(update, config): return
     
     await update.message.reply_text("Gerando status e diagnóstico...")
@@ -241,20 +474,21 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status_text = (f"📊 *Status e Diagnóstico*\n\n"
                    f"∙ Monitoramento: {'🟢 Ativo' if config.get('monitoring_on') else '🔴 Inativo'}\n"
                    f"∙ Palavras-chave: {len(config.get('keywords', []))}\n"
-                   f"∙ Histórico: {len(config.get('history', set()))} links")
+                   f"∙ Histórico: {len(config['history'])} links")
                    
     keywords = config.get('keywords', [])
     if keywords:
         found_news = await fetch_news(keywords)
         if found_news:
-            relevant_news = [n for n in found_news if any(k.lower() in f"{n['title']} {n['source']}".lower() for k in keywords)]
+            pattern = build_keyword_pattern(keywords)
+            relevant_news = [n for n in found_news if pattern.search(f"{n['title']} {n['source']}".lower())]
             success_rate = (len(relevant_news) / len(found_news)) * 100 if found_news else 0
             status_text += f"\n∙ Performance: {success_rate:.1f}% de taxa de sucesso"
     
     await update.message.reply_text(status_text, parse_mode=ParseMode.MARKDOWN)
 
 async def view_keywords(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    config = load_config()
+    config = await load_config()
     if not is_owner(update, config): return
     keywords = config.get('keywords', [])
     await update.message.reply_text(f"📝 *Palavras-Chave:* {', '.join(keywords)}" if keywords else "Nenhuma.")
@@ -269,13 +503,20 @@ def main():
         logger.error("ERRO: BOT_TOKEN não configurado!")
         return
 
+    atexit.register(flush_config)
+
     application = Application.builder().token(BOT_TOKEN).build()
 
     async def post_init(app: Application):
-        context = ContextTypes.DEFAULT_TYPE(application=app)
-        asyncio.create_task(monitor_loop(context))
+        await load_config()
+        asyncio.create_task(monitor_loop(app))
+        asyncio.create_task(flusher())
     application.post_init = post_init
 
+    async def post_shutdown(app: Application):
+        await _HTTP.aclose()
+    application.post_shutdown = post_shutdown
+
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('monitoramento', toggle_monitoring))
@@ -287,7 +528,9 @@ def main():
     application.add_handler(MessageHandler(filters.Document.FileExtension("json"), restore_handler))
     
     logger.info("🚀 Faro Fino Bot - Versão Final iniciado!")
-    application.run_polling()
+    # Long polling: o Telegram segura o getUpdates até chegar uma mensagem (máx. 50s),
+    # enquanto o monitoramento roda em sua própria task.
+    application.run_polling(timeout=POLLING_TIMEOUT, allowed_updates=[Update.MESSAGE])
 
 if __name__ == "__main__":
     main()